@@ -1,12 +1,1051 @@
 import sys
+import os
+import argparse
+import struct
+import resource
+import re
+import json
+import operator
+import threading
+import tempfile
 import subprocess
 import time
 import glob
+import contextlib
+import warnings
+import urllib.request
+from urllib.parse import urlparse
 from PyQt6.QtWidgets import (QApplication, QLabel, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QMainWindow, QInputDialog, QLineEdit,
-                             QGroupBox, QGridLayout, QComboBox, QFormLayout, QCheckBox, QMessageBox)
-from PyQt6.QtCore import Qt, QTimer
+                             QGroupBox, QGridLayout, QComboBox, QFormLayout, QCheckBox, QMessageBox, QListWidget,
+                             QPlainTextEdit, QFileDialog, QTableWidget, QTableWidgetItem)
+from PyQt6.QtCore import Qt, QTimer, QEvent
 from pynvml import *
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CONFIG_DIR = os.path.expanduser("~/.config/HWMi")
+ALERT_RULES_PATH = os.path.join(CONFIG_DIR, "alerts.conf")
+ALERT_WEBHOOK_URL = "http://127.0.0.1:8787/hwmi/alert"
+RAPL_ENERGY_PATH = "/sys/class/powercap/intel-rapl:0/energy_uj"
+HISTORY_DIR = os.path.expanduser("~/.local/share/HWMi/history")
+HISTORY_COLUMNS = ('timestamp', 'elapsed', 'cpu_wattage', 'vcore', 'cpu_freq', 'cpu_temp', 'cpu_temp_max',
+                   'gpu_core_clock', 'gpu_memory_clock', 'gpu_temp')
+HISTORY_TIME_COLUMNS = ('timestamp', 'elapsed')
+# Update interval in ms for each sampling policy
+SAMPLING_POLICIES = {
+    'full': 1000,
+    'battery': 2000,
+    'background': 10000,
+    'background_battery': 30000,
+}
+ALERT_METRICS = ('cpu_wattage', 'vcore', 'cpu_freq', 'cpu_temp', 'cpu_temp_max', 'gpu_core_clock',
+                 'gpu_memory_clock', 'gpu_temp', 'pl1', 'pl2')
+DEFAULT_ALERT_RULES = [
+    "gpu_temp > 83 for 10s clear 78 cooldown 60s do notify,log",
+    "cpu_wattage > pl1 for 30s cooldown 120s do notify,log",
+]
+
+def run_overclock_script(gpu_index, gpu_offset, mem_offset, power_limit, fan_speed_script=""):
+    script_content = f"""
+from pynvml import *
+nvmlInit()
+myGPU = nvmlDeviceGetHandleByIndex({gpu_index})
+nvmlDeviceSetGpcClkVfOffset(myGPU, {gpu_offset})
+nvmlDeviceSetMemClkVfOffset(myGPU, {mem_offset})
+nvmlDeviceSetPowerManagementLimit(myGPU, {power_limit})
+{fan_speed_script}
+nvmlShutdown()
+"""
+    # A private, uniquely named file so concurrent runs and other users can't swap it out
+    fd, temp_script_path = tempfile.mkstemp(prefix="hwmi_overclock_", suffix=".py")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(script_content)
+
+        # Run the script using pkexec for root privileges
+        return subprocess.run(["pkexec", "python3", temp_script_path], capture_output=True, text=True)
+    finally:
+        os.remove(temp_script_path)
+
+def read_cpu_busy_ticks():
+    # Busy clock ticks summed over all CPUs, from the aggregate line of /proc/stat
+    try:
+        with open('/proc/stat', 'rb') as f:
+            fields = [int(value) for value in f.readline().split()[1:9]]
+        return sum(fields) - fields[3] - fields[4]  # minus idle and iowait
+    except Exception as e:
+        return None
+
+class AlertRule:
+    # e.g. "gpu_temp > 83 for 10s clear 78 cooldown 60s do notify,log"
+    PATTERN = re.compile(r'^\s*(?P<metric>\w+)\s*(?P<op>>=|<=|>|<)\s*(?P<threshold>[\w.]+)'
+                         r'(?:\s+for\s+(?P<duration>\d+(?:\.\d+)?)s?)?'
+                         r'(?:\s+clear\s+(?P<clear>[\w.]+))?'
+                         r'(?:\s+cooldown\s+(?P<cooldown>\d+(?:\.\d+)?)s?)?'
+                         r'(?:\s+do\s+(?P<actions>[\w,]+))?\s*$')
+    OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+    ACTIONS = ('notify', 'log', 'webhook', 'fallback')
+    HYSTERESIS = 0.05  # Default clear band as a fraction of the threshold
+
+    def __init__(self, text):
+        match = self.PATTERN.match(text)
+        if not match:
+            raise ValueError(f"Invalid alert rule: {text}")
+        self.text = text.strip()
+        self.metric = match.group('metric')
+        if self.metric not in ALERT_METRICS:
+            raise ValueError(f"Unknown alert metric: {self.metric}")
+        self.op = match.group('op')
+        self.compare = self.OPERATORS[self.op]
+        self.rising = self.op in ('>', '>=')
+        self.threshold = self.compile_operand(match.group('threshold'))
+        self.clear = self.compile_operand(match.group('clear')) if match.group('clear') else self.default_clear
+        self.duration = float(match.group('duration') or 0)
+        self.cooldown = float(match.group('cooldown') or 0)
+        self.actions = (match.group('actions') or 'log').split(',')
+        for action in self.actions:
+            if action not in self.ACTIONS:
+                raise ValueError(f"Unknown alert action: {action}")
+
+        self.active = False
+        self.pending_since = None
+        self.last_fired = None
+
+    @staticmethod
+    def compile_operand(operand):
+        try:
+            value = float(operand)
+            return lambda snapshot: value
+        except ValueError:
+            if operand not in ALERT_METRICS:
+                raise ValueError(f"Unknown alert metric: {operand}")
+            return lambda snapshot: snapshot.get(operand)
+
+    def default_clear(self, snapshot):
+        threshold = self.threshold(snapshot)
+        if threshold is None:
+            return None
+        band = abs(threshold) * self.HYSTERESIS
+        return threshold - band if self.rising else threshold + band
+
+    @property
+    def armed(self):
+        return self.pending_since is not None and not self.active
+
+    def evaluate(self, snapshot, now):
+        value = snapshot.get(self.metric)
+        if value is None:
+            # A gap in the readings restarts the duration
+            self.pending_since = None
+            return False
+
+        if self.active:
+            clear = self.clear(snapshot)
+            if clear is not None and (value <= clear if self.rising else value >= clear):
+                self.active = False
+                self.pending_since = None
+            return False
+
+        threshold = self.threshold(snapshot)
+        if threshold is None or not self.compare(value, threshold):
+            self.pending_since = None
+            return False
+
+        if self.pending_since is None:
+            self.pending_since = now
+        if now - self.pending_since < self.duration:
+            return False
+
+        self.active = True
+        if self.last_fired is not None and now - self.last_fired < self.cooldown:
+            return False
+        self.last_fired = now
+        return True
+
+class AlertEngine:
+    def __init__(self, rules_path=ALERT_RULES_PATH, webhook_url=ALERT_WEBHOOK_URL, gpu_index=0):
+        self.rules_path = rules_path
+        self.webhook_url = webhook_url
+        self.gpu_index = gpu_index
+        self.fallback_lock = threading.Lock()
+        self.rules = []
+        self.load_rules()
+
+    def load_rules(self):
+        try:
+            with open(self.rules_path, 'r') as f:
+                lines = f.read().rstrip('\n').split('\n')
+        except FileNotFoundError:
+            lines = DEFAULT_ALERT_RULES
+        # Comments, blank lines and rules that failed to parse are kept as raw text
+        # so saving the file never drops them
+        self.lines = []
+        self.rules = []
+        for line in lines:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('#'):
+                try:
+                    rule = AlertRule(stripped)
+                    self.lines.append(rule)
+                    self.rules.append(rule)
+                    continue
+                except ValueError as e:
+                    print(f"Error: {str(e)}")
+            self.lines.append(line)
+
+    def save_rules(self):
+        os.makedirs(os.path.dirname(self.rules_path), exist_ok=True)
+        with open(self.rules_path, 'w') as f:
+            for line in self.lines:
+                f.write((line.text if isinstance(line, AlertRule) else line) + '\n')
+
+    def add_rule(self, text):
+        rule = AlertRule(text)
+        self.lines.append(rule)
+        self.rules.append(rule)
+        self.save_rules()
+        return rule
+
+    def remove_rule(self, index):
+        rule = self.rules.pop(index)
+        self.lines = [line for line in self.lines if line is not rule]
+        self.save_rules()
+
+    @property
+    def armed(self):
+        return any(rule.armed or rule.active for rule in self.rules)
+
+    def evaluate(self, snapshot, now=None):
+        if now is None:
+            now = time.monotonic()
+        for rule in self.rules:
+            if rule.evaluate(snapshot, now):
+                self.dispatch(rule, snapshot)
+
+    def dispatch(self, rule, snapshot):
+        message = f"{rule.text} (value: {snapshot.get(rule.metric):.2f})"
+        for action in rule.actions:
+            try:
+                if action == 'notify':
+                    subprocess.Popen(['notify-send', '-a', 'HWMi', 'HWMi Alert', message])
+                elif action == 'log':
+                    print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())} ALERT: {message}")
+                elif action == 'webhook':
+                    self.send_webhook(rule, snapshot)
+                elif action == 'fallback':
+                    # Only one pkexec prompt at a time
+                    if self.fallback_lock.acquire(blocking=False):
+                        threading.Thread(target=self.apply_fallback_profile, args=(self.gpu_index,), daemon=True).start()
+                    else:
+                        print("Fallback profile already being applied, skipping")
+            except Exception as e:
+                print(f"Error running alert action {action}: {str(e)}")
+
+    def send_webhook(self, rule, snapshot):
+        if urlparse(self.webhook_url).hostname not in ('127.0.0.1', 'localhost', '::1'):
+            raise Exception("Alert webhook must point to a local endpoint")
+        payload = json.dumps({'rule': rule.text, 'metric': rule.metric, 'snapshot': snapshot}).encode()
+        request = urllib.request.Request(self.webhook_url, data=payload, headers={'Content-Type': 'application/json'})
+
+        def post():
+            try:
+                urllib.request.urlopen(request, timeout=2).close()
+            except Exception as e:
+                print(f"Error sending alert webhook: {str(e)}")
+
+        threading.Thread(target=post, daemon=True).start()
+
+    def apply_fallback_profile(self, gpu_index):
+        # Reset clock offsets and restore the default power limit
+        try:
+            nvmlInit()
+            try:
+                handle = nvmlDeviceGetHandleByIndex(gpu_index)
+                power_limit = nvmlDeviceGetPowerManagementDefaultLimit(handle)
+            finally:
+                nvmlShutdown()
+            fan_script = ("for fan in range(nvmlDeviceGetNumFans(myGPU)):\n"
+                          "    nvmlDeviceSetDefaultFanSpeed_v2(myGPU, fan)\n")
+            result = run_overclock_script(gpu_index, 0, 0, power_limit, fan_script)
+            if result.returncode != 0:
+                print(f"Error applying fallback profile: {result.stderr}")
+        except Exception as e:
+            print(f"Error applying fallback profile: {str(e)}")
+        finally:
+            self.fallback_lock.release()
+
+class AlertsWindow(QWidget):
+    def __init__(self, alert_engine):
+        super().__init__()
+        self.alert_engine = alert_engine
+        self.initUI()
+
+    def initUI(self):
+        self.setWindowTitle('Alert Rules')
+
+        layout = QVBoxLayout()
+
+        self.rules_list = QListWidget(self)
+        layout.addWidget(self.rules_list)
+
+        self.rule_input = QLineEdit(self)
+        self.rule_input.setPlaceholderText("gpu_temp > 83 for 10s clear 78 cooldown 60s do notify,log")
+        layout.addWidget(self.rule_input)
+
+        buttons_layout = QHBoxLayout()
+        self.add_button = QPushButton('Add Rule', self)
+        self.add_button.clicked.connect(self.add_rule)
+        buttons_layout.addWidget(self.add_button)
+        self.remove_button = QPushButton('Remove Rule', self)
+        self.remove_button.clicked.connect(self.remove_rule)
+        buttons_layout.addWidget(self.remove_button)
+        layout.addLayout(buttons_layout)
+
+        self.help_label = QLabel(f"Metrics: {', '.join(ALERT_METRICS)}\n"
+                                 f"Actions: {', '.join(AlertRule.ACTIONS)}", self)
+        self.help_label.setWordWrap(True)
+        layout.addWidget(self.help_label)
+
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh_rules)
+
+    def refresh_rules(self):
+        row = self.rules_list.currentRow()
+        self.rules_list.clear()
+        for rule in self.alert_engine.rules:
+            if rule.active:
+                status = "ACTIVE"
+            elif rule.armed:
+                status = "ARMED"
+            else:
+                status = "OK"
+            self.rules_list.addItem(f"[{status}] {rule.text}")
+        self.rules_list.setCurrentRow(row)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh_rules()
+        self.timer.start(1000)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.timer.stop()
+
+    def add_rule(self):
+        try:
+            self.alert_engine.add_rule(self.rule_input.text())
+            self.rule_input.clear()
+            self.refresh_rules()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e))
+
+    def remove_rule(self):
+        row = self.rules_list.currentRow()
+        if row < 0:
+            return
+        try:
+            self.alert_engine.remove_rule(row)
+            self.refresh_rules()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e))
+
+class LatencyHistogram:
+    # Log-linear buckets in the spirit of HdrHistogram, ~3% relative precision
+    SUB_BUCKET_BITS = 5
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value_us):
+        value_us = max(int(value_us), 0)
+        shift = max(value_us.bit_length() - self.SUB_BUCKET_BITS - 1, 0)
+        bucket = (value_us >> shift) << shift
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value_us
+        self.min = value_us if self.min is None else min(self.min, value_us)
+        self.max = value_us if self.max is None else max(self.max, value_us)
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        target = self.count * percent / 100
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return bucket
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'min_us': self.min,
+            'mean_us': self.total / self.count if self.count else None,
+            'p50_us': self.percentile(50),
+            'p90_us': self.percentile(90),
+            'p99_us': self.percentile(99),
+            'max_us': self.max,
+        }
+
+class Instrumentation:
+    def __init__(self):
+        self.histograms = {}
+        self.subprocess_counts = {}
+        self.tick_interval = 1.0
+        self.last_tick = None
+        self.tick_start = None
+        self.tick_collect_ns = 0
+        self.sampling_policy = 'full'
+        self.last_process_time = self.get_process_cpu_time()
+        self.last_busy_time = self.get_system_busy_time()
+        self.last_wall_time = time.monotonic()
+        self.cpu_percent = 0.0
+        self.power_watts = None
+        self.rss_bytes = 0
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+        return self.histograms[name]
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self.tick_collect_ns += elapsed
+            self.histogram(name).record(elapsed / 1000)
+
+    def run(self, args, name=None, **kwargs):
+        if name is None:
+            name = args.split()[0] if isinstance(args, str) else args[0]
+        self.subprocess_counts[name] = self.subprocess_counts.get(name, 0) + 1
+        return subprocess.run(args, **kwargs)
+
+    def set_tick_interval(self, interval):
+        # The timer restarts with a new phase, so the next interval is not a real tick
+        self.tick_interval = interval
+        self.last_tick = None
+
+    def begin_tick(self, timed=False):
+        # Only timer-driven ticks count towards interval and jitter, manual refreshes
+        # don't shift the timer's phase
+        if timed:
+            now = time.monotonic()
+            if self.last_tick is not None:
+                interval = now - self.last_tick
+                self.histogram('tick_interval').record(interval * 1e6)
+                self.histogram('tick_jitter').record(abs(interval - self.tick_interval) * 1e6)
+            self.last_tick = now
+        self.tick_start = time.perf_counter_ns()
+        self.tick_collect_ns = 0
+
+    def end_tick(self, package_watts=None):
+        total = time.perf_counter_ns() - self.tick_start
+        self.histogram('tick_total').record(total / 1000)
+        self.histogram('render').record(max(total - self.tick_collect_ns, 0) / 1000)
+        self.update_process_stats(package_watts)
+
+    @staticmethod
+    def get_process_cpu_time():
+        # Include reaped children so sudo and rdmsr are counted
+        times = os.times()
+        return times.user + times.system + times.children_user + times.children_system
+
+    @staticmethod
+    def get_system_busy_time():
+        busy_ticks = read_cpu_busy_ticks()
+        return busy_ticks / os.sysconf('SC_CLK_TCK') if busy_ticks is not None else None
+
+    def update_process_stats(self, package_watts=None):
+        process_time = self.get_process_cpu_time()
+        busy_time = self.get_system_busy_time()
+        wall_time = time.monotonic()
+        if wall_time > self.last_wall_time:
+            self.cpu_percent = (process_time - self.last_process_time) / (wall_time - self.last_wall_time) * 100
+
+        # Apportion package power by the monitor's share of busy CPU time
+        self.power_watts = None
+        if package_watts is not None and busy_time is not None and self.last_busy_time is not None:
+            busy_delta = busy_time - self.last_busy_time
+            if busy_delta > 0:
+                self.power_watts = package_watts * min((process_time - self.last_process_time) / busy_delta, 1.0)
+
+        self.last_process_time = process_time
+        self.last_busy_time = busy_time
+        self.last_wall_time = wall_time
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                self.rss_bytes = int(f.read().split()[1]) * self.page_size
+        except Exception as e:
+            pass
+
+    def to_dict(self):
+        return {
+            'sampling_policy': self.sampling_policy,
+            'tick_interval': self.tick_interval,
+            'cpu_percent': self.cpu_percent,
+            'power_watts': self.power_watts,
+            'rss_bytes': self.rss_bytes,
+            'subprocess_counts': dict(self.subprocess_counts),
+            'histograms': {name: histogram.summary() for name, histogram in self.histograms.items()},
+        }
+
+    def format_report(self):
+        power = f"{self.power_watts:.3f} W" if self.power_watts is not None else "Unknown"
+        lines = [
+            f"Sampling: {self.sampling_policy} ({self.tick_interval * 1000:.0f} ms)",
+            f"Monitor CPU: {self.cpu_percent:.2f} %",
+            f"Monitor Power (est.): {power}",
+            f"Monitor RSS: {self.rss_bytes / 1048576:.1f} MiB",
+            f"Subprocesses: {sum(self.subprocess_counts.values())} "
+            + ", ".join(f"{name}={count}" for name, count in sorted(self.subprocess_counts.items())),
+            "",
+            f"{'Step':<16}{'count':>8}{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}{'max us':>10}",
+        ]
+        for name in sorted(self.histograms):
+            summary = self.histograms[name].summary()
+            lines.append(f"{name:<16}{summary['count']:>8}{summary['p50_us']:>10}{summary['p90_us']:>10}"
+                         f"{summary['p99_us']:>10}{summary['max_us']:>10}")
+        return "\n".join(lines)
+
+class DebugWindow(QWidget):
+    def __init__(self, instrumentation):
+        super().__init__()
+        self.instrumentation = instrumentation
+        self.initUI()
+
+    def initUI(self):
+        self.setWindowTitle('Monitor Debug')
+        self.setGeometry(150, 150, 640, 400)
+
+        layout = QVBoxLayout()
+
+        self.report_text = QPlainTextEdit(self)
+        self.report_text.setReadOnly(True)
+        self.report_text.setStyleSheet("font-family: monospace;")
+        layout.addWidget(self.report_text)
+
+        self.export_button = QPushButton('Export JSON', self)
+        self.export_button.clicked.connect(self.export_report)
+        layout.addWidget(self.export_button)
+
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh_report)
+
+    def refresh_report(self):
+        self.report_text.setPlainText(self.instrumentation.format_report())
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh_report()
+        self.timer.start(1000)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.timer.stop()
+
+    def export_report(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Instrumentation", "hwmi-instrumentation.json", "JSON (*.json)")
+        if not path:
+            return
+        try:
+            with open(path, 'w') as f:
+                json.dump(self.instrumentation.to_dict(), f, indent=2)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e))
+
+class HistoryRecorder:
+    # Rows of little-endian float64, one per tick, with missing metrics stored as NaN.
+    # The column names live in a JSON sidecar so sessions can be memory-mapped as is.
+    # 'elapsed' is monotonic seconds since the session started, unaffected by clock steps.
+    FLUSH_INTERVAL = 10  # seconds, so slow background policies still reach disk promptly
+
+    def __init__(self, history_dir=HISTORY_DIR, columns=HISTORY_COLUMNS):
+        self.history_dir = history_dir
+        self.columns = columns
+        self.row_format = struct.Struct(f"<{len(columns)}d")
+        self.path = None
+        self.file = None
+        self.start_time = None
+        self.last_flush = None
+
+    def open(self):
+        os.makedirs(self.history_dir, exist_ok=True)
+        name = time.strftime('session-%Y%m%d-%H%M%S', time.localtime())
+        self.path = os.path.join(self.history_dir, name + '.bin')
+        with open(os.path.join(self.history_dir, name + '.json'), 'w') as f:
+            json.dump({'columns': list(self.columns), 'dtype': '<f8'}, f)
+        self.file = open(self.path, 'ab')
+        self.start_time = time.monotonic()
+        self.last_flush = self.start_time
+
+    def record(self, snapshot, timestamp=None):
+        if self.file is None:
+            self.open()
+        if timestamp is None:
+            timestamp = time.time()
+        now = time.monotonic()
+        values = dict(snapshot, timestamp=timestamp, elapsed=now - self.start_time)
+        self.file.write(self.row_format.pack(*(values.get(column, float('nan')) for column in self.columns)))
+        if now - self.last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def list_history_sessions(history_dir=HISTORY_DIR):
+    return sorted(glob.glob(os.path.join(history_dir, 'session-*.bin')))
+
+def load_history(path):
+    if np is None:
+        raise Exception("numpy is required for history analytics")
+    with open(os.path.splitext(path)[0] + '.json', 'r') as f:
+        header = json.load(f)
+    columns = header['columns']
+    # Ignore a trailing partial row from a session that is still being written
+    row_count = os.path.getsize(path) // (8 * len(columns))
+    if row_count == 0:
+        return columns, np.empty((0, len(columns)))
+    data = np.memmap(path, dtype=header.get('dtype', '<f8'), mode='r', shape=(row_count, len(columns)))
+    return columns, data
+
+def history_times(columns, data):
+    # Sessions recorded before 'elapsed' existed only have wall-clock timestamps
+    if 'elapsed' in columns:
+        return np.asarray(data[:, columns.index('elapsed')])
+    timestamps = np.asarray(data[:, columns.index('timestamp')])
+    return timestamps - timestamps[0]
+
+def history_weights(times):
+    # Each row stands for the interval since the previous one, which depends on the
+    # sampling policy. Gaps longer than the slowest policy are recording pauses.
+    if len(times) < 2:
+        return np.ones(len(times))
+    weights = np.clip(np.diff(times, prepend=times[0]), 0, max(SAMPLING_POLICIES.values()) / 1000)
+    weights[0] = weights[1]
+    return weights
+
+def weighted_percentiles(values, weights, percents=(50, 95, 99)):
+    mask = ~np.isnan(values) & (weights > 0)
+    values, weights = values[mask], weights[mask]
+    if not len(values):
+        return np.full(len(percents), np.nan)
+    order = np.argsort(values)
+    values, cumulative = values[order], np.cumsum(weights[order])
+    targets = np.asarray(percents) / 100 * cumulative[-1]
+    return values[np.minimum(np.searchsorted(cumulative, targets), len(values) - 1)]
+
+def summarize_history(data, weights, percents=(50, 95, 99)):
+    # Metrics that were never sampled (e.g. no GPU) are all NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        valid = ~np.isnan(data)
+        weighted = np.where(valid, weights[:, None], 0)
+        return {
+            'percentiles': np.column_stack([weighted_percentiles(data[:, i], weights, percents)
+                                            for i in range(data.shape[1])]),
+            'mean': np.where(valid, data, 0).T @ weights / weighted.sum(axis=0),
+            'min': np.nanmin(data, axis=0),
+            'max': np.nanmax(data, axis=0),
+        }
+
+def windowed_percentiles(timestamps, values, window_s, percents=(50, 95, 99)):
+    mask = ~np.isnan(values)
+    timestamps, values = timestamps[mask], values[mask]
+    if not len(values):
+        return np.empty(0), np.empty((0, len(percents)))
+
+    # Sort by (window, value) once, then index every window's percentiles together
+    start = timestamps.min()
+    windows = ((timestamps - start) // window_s).astype(np.int64)
+    order = np.lexsort((values, windows))
+    windows, values = windows[order], values[order]
+    starts = np.flatnonzero(np.r_[True, windows[1:] != windows[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+    positions = starts[:, None] + (counts[:, None] - 1) * (np.asarray(percents) / 100)[None, :]
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    result = values[lower] + (values[upper] - values[lower]) * (positions - lower)
+    return start + windows[starts] * window_s, result
+
+def history_histogram(values, weights, bins=10):
+    mask = ~np.isnan(values)
+    if not mask.any():
+        return np.zeros(bins), np.zeros(bins + 1)
+    return np.histogram(values[mask], bins=bins, weights=weights[mask])
+
+def resample_history(times, data, period_s):
+    if not len(times):
+        return np.empty(0), np.empty((0, data.shape[1]))
+    # Bucket from the earliest time so out-of-order rows can't produce negative buckets
+    start = times.min()
+    buckets = ((times - start) // period_s).astype(np.int64)
+    size = buckets.max() + 1
+    valid = ~np.isnan(data)
+    means = np.empty((size, data.shape[1]))
+    for column in range(data.shape[1]):
+        sums = np.bincount(buckets, weights=np.where(valid[:, column], data[:, column], 0), minlength=size)
+        counts = np.bincount(buckets, weights=valid[:, column], minlength=size)
+        with np.errstate(all='ignore'):
+            means[:, column] = sums / counts
+    keep = ~np.isnan(means).all(axis=1)
+    return (start + np.arange(size) * period_s)[keep], means[keep]
+
+def correlate_history(data):
+    # Pairwise-complete rows, so one metric that was never read (e.g. Vcore without
+    # the msr module) doesn't blank out the whole matrix
+    size = data.shape[1]
+    valid = ~np.isnan(data)
+    matrix = np.full((size, size), np.nan)
+    for i in range(size):
+        for j in range(i, size):
+            both = valid[:, i] & valid[:, j]
+            if both.sum() < 2:
+                continue
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                matrix[i, j] = matrix[j, i] = np.corrcoef(data[both, i], data[both, j])[0, 1]
+    return matrix
+
+def format_history_report(path, window_s=60):
+    columns, data = load_history(path)
+    lines = [f"Session: {path}", f"Samples: {len(data)}"]
+    if not len(data):
+        return "\n".join(lines)
+
+    times = history_times(columns, data)
+    weights = history_weights(times)
+    lines.append(f"Duration: {times.max() - times.min():.0f} s")
+    metrics = [column for column in columns if column not in HISTORY_TIME_COLUMNS]
+    values = data[:, [columns.index(metric) for metric in metrics]]
+
+    summary = summarize_history(values, weights)
+    lines += ["", "Percentiles, means and distributions are weighted by sampling interval",
+              "", f"{'Metric':<18}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}{'min':>10}{'max':>10}"]
+    for i, metric in enumerate(metrics):
+        p50, p95, p99 = summary['percentiles'][:, i]
+        lines.append(f"{metric:<18}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}{summary['mean'][i]:>10.2f}"
+                     f"{summary['min'][i]:>10.2f}{summary['max'][i]:>10.2f}")
+
+    lines += ["", f"p95 per {window_s:g} s window (min / median / max):"]
+    for i, metric in enumerate(metrics):
+        _, window_values = windowed_percentiles(times, values[:, i], window_s, (95,))
+        if len(window_values):
+            p95 = window_values[:, 0]
+            lines.append(f"{metric:<18}{p95.min():>10.2f}{np.median(p95):>10.2f}{p95.max():>10.2f}")
+
+    for metric in ('cpu_wattage', 'cpu_temp', 'gpu_temp'):
+        seconds, edges = history_histogram(values[:, metrics.index(metric)], weights)
+        if not seconds.sum():
+            continue
+        lines += ["", f"{metric} distribution (seconds):"]
+        for duration, low, high in zip(seconds, edges[:-1], edges[1:]):
+            bar = '#' * int(round(40 * duration / seconds.max()))
+            lines.append(f"{low:>9.2f} - {high:<9.2f}{duration:>9.0f} {bar}")
+
+    correlated = ['cpu_freq', 'cpu_temp', 'vcore', 'cpu_wattage']
+    matrix = correlate_history(values[:, [metrics.index(metric) for metric in correlated]])
+    lines += ["", "Correlation:", " " * 14 + "".join(f"{metric:>14}" for metric in correlated)]
+    for metric, row in zip(correlated, matrix):
+        lines.append(f"{metric:<14}" + "".join(f"{value:>14.3f}" for value in row))
+    return "\n".join(lines)
+
+class ReportWindow(QWidget):
+    def __init__(self):
+        super().__init__()
+        self.initUI()
+
+    def initUI(self):
+        self.setWindowTitle('History Report')
+        self.setGeometry(150, 150, 900, 700)
+
+        layout = QVBoxLayout()
+
+        controls_layout = QHBoxLayout()
+        self.session_combo = QComboBox(self)
+        for path in reversed(list_history_sessions()):
+            self.session_combo.addItem(os.path.basename(path), path)
+        controls_layout.addWidget(self.session_combo)
+        self.window_combo = QComboBox(self)
+        for window_s in (10, 60, 300, 3600):
+            self.window_combo.addItem(f"{window_s} s window", window_s)
+        self.window_combo.setCurrentIndex(1)
+        controls_layout.addWidget(self.window_combo)
+        self.report_button = QPushButton('Generate Report', self)
+        self.report_button.clicked.connect(self.generate_report)
+        controls_layout.addWidget(self.report_button)
+        layout.addLayout(controls_layout)
+
+        self.report_text = QPlainTextEdit(self)
+        self.report_text.setReadOnly(True)
+        self.report_text.setStyleSheet("font-family: monospace;")
+        layout.addWidget(self.report_text)
+
+        self.setLayout(layout)
+        if self.session_combo.count():
+            self.generate_report()
+        else:
+            self.report_text.setPlainText("No recorded sessions")
+
+    def generate_report(self):
+        path = self.session_combo.currentData()
+        if not path:
+            return
+        try:
+            self.report_text.setPlainText(format_history_report(path, self.window_combo.currentData()))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e))
+
+class ProcessTracker:
+    MAX_CACHED_FILES = 8192
+
+    def __init__(self):
+        self.processes = {}
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.last_time = None
+        self.last_busy_ticks = None
+        self.cached_files = 0
+        self.original_file_limit = None
+        self.max_cached_files = self.raise_file_limit()
+        self.gpu_handles = []
+        self.gpu_last_seen = {}
+        self.nvml_initialized = False
+        try:
+            nvmlInit()
+            self.nvml_initialized = True
+            self.gpu_handles = [nvmlDeviceGetHandleByIndex(i) for i in range(nvmlDeviceGetCount())]
+        except Exception as e:
+            print(f"Error initializing NVML for process view: {str(e)}")
+
+    def raise_file_limit(self):
+        # Keep /proc/<pid>/stat open between scans, leaving half the descriptors for everything else
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            wanted = self.MAX_CACHED_FILES * 2
+            if soft != resource.RLIM_INFINITY and soft < wanted:
+                raised = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+                resource.setrlimit(resource.RLIMIT_NOFILE, (raised, hard))
+                # Restored in close() so later sudo/rdmsr children don't inherit it
+                self.original_file_limit = (soft, hard)
+                soft = raised
+        except Exception as e:
+            soft = 1024
+        if soft == resource.RLIM_INFINITY:
+            return self.MAX_CACHED_FILES
+        return min(soft // 2, self.MAX_CACHED_FILES)
+
+    def read_stat(self, pid, state):
+        if state['file'] is not None:
+            state['file'].seek(0)
+            data = state['file'].read()
+        else:
+            with open(f"/proc/{pid}/stat", 'rb', buffering=0) as f:
+                data = f.read()
+        # The command name may contain spaces and parentheses, so split on the last ')'
+        comm_end = data.rindex(b')')
+        fields = data[comm_end + 2:].split()
+        comm = data[data.index(b'(') + 1:comm_end]
+        return int(fields[11]) + int(fields[12]), int(fields[19]), comm  # utime + stime, starttime, comm
+
+    def track(self, pid):
+        state = {'file': None, 'name': None, 'ticks': None, 'starttime': None, 'delta': 0,
+                 'cpu_percent': 0.0, 'watts': 0.0, 'energy_j': 0.0}
+        if self.cached_files < self.max_cached_files:
+            try:
+                state['file'] = open(f"/proc/{pid}/stat", 'rb', buffering=0)
+                self.cached_files += 1
+            except OSError:
+                return None
+        self.processes[pid] = state
+        return state
+
+    def forget(self, pid):
+        state = self.processes.pop(pid)
+        if state['file'] is not None:
+            state['file'].close()
+            self.cached_files -= 1
+
+    def update(self, package_watts=None):
+        now = time.monotonic()
+        busy_ticks = read_cpu_busy_ticks()
+        elapsed = now - self.last_time if self.last_time is not None else None
+        busy_delta = busy_ticks - self.last_busy_ticks if busy_ticks is not None and self.last_busy_ticks is not None else None
+        self.last_time = now
+        self.last_busy_ticks = busy_ticks
+
+        pids = {int(entry) for entry in os.listdir('/proc') if entry.isdigit()}
+        for pid in [pid for pid in self.processes if pid not in pids]:
+            self.forget(pid)
+
+        for pid in pids:
+            state = self.processes.get(pid) or self.track(pid)
+            if state is None:
+                continue
+            try:
+                ticks, starttime, comm = self.read_stat(pid, state)
+            except (OSError, ValueError, IndexError):
+                self.forget(pid)
+                continue
+
+            if state['starttime'] != starttime:
+                # New process, or an uncached PID that was reused since the last scan
+                state['ticks'] = None
+                state['energy_j'] = 0.0
+                state['starttime'] = starttime
+                state['name'] = comm.decode(errors='replace')
+            state['delta'] = ticks - state['ticks'] if state['ticks'] is not None else 0
+            state['ticks'] = ticks
+
+            if elapsed:
+                state['cpu_percent'] = state['delta'] / self.clock_ticks / elapsed * 100
+                if package_watts is not None and busy_delta:
+                    state['watts'] = package_watts * min(state['delta'] / busy_delta, 1.0)
+                    state['energy_j'] += state['watts'] * elapsed
+                else:
+                    state['watts'] = 0.0
+
+        gpu_usage = self.update_gpu()
+        for pid, state in self.processes.items():
+            state['gpu'] = gpu_usage.get(pid)
+
+    def update_gpu(self):
+        usage = {}
+        for index, handle in enumerate(self.gpu_handles):
+            try:
+                running = nvmlDeviceGetComputeRunningProcesses(handle) + nvmlDeviceGetGraphicsRunningProcesses(handle)
+                # A process using both compute and graphics is listed twice with the same allocation
+                device_memory = {}
+                for process in running:
+                    device_memory[process.pid] = max(device_memory.get(process.pid, 0), process.usedGpuMemory or 0)
+                for pid, memory in device_memory.items():
+                    entry = usage.setdefault(pid, {'sm_util': 0, 'samples': 0, 'memory_mib': 0.0})
+                    entry['memory_mib'] += memory / 1048576
+            except Exception as e:
+                pass
+
+            # Only ask for samples newer than the last one seen on this device
+            try:
+                samples = nvmlDeviceGetProcessUtilization(handle, self.gpu_last_seen.get(index, 0))
+            except Exception as e:
+                samples = []  # NVML reports NOT_FOUND when there are no new samples
+            for sample in samples:
+                entry = usage.setdefault(sample.pid, {'sm_util': 0, 'samples': 0, 'memory_mib': 0.0})
+                entry['sm_util'] += sample.smUtil
+                entry['samples'] += 1
+                self.gpu_last_seen[index] = max(self.gpu_last_seen.get(index, 0), sample.timeStamp)
+
+        for entry in usage.values():
+            if entry['samples']:
+                entry['sm_util'] /= entry['samples']
+        return usage
+
+    def top(self, count=50):
+        def key(item):
+            gpu = item[1].get('gpu')
+            return (item[1]['cpu_percent'], gpu['sm_util'] if gpu else 0)
+        return sorted(self.processes.items(), key=key, reverse=True)[:count]
+
+    def close(self):
+        for pid in list(self.processes):
+            self.forget(pid)
+        self.last_time = None
+        self.last_busy_ticks = None
+        if self.original_file_limit is not None:
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, self.original_file_limit)
+            except Exception as e:
+                print(f"Error restoring file limit: {str(e)}")
+            self.original_file_limit = None
+        if self.nvml_initialized:
+            self.gpu_handles = []
+            self.nvml_initialized = False
+            nvmlShutdown()
+
+class ProcessWindow(QWidget):
+    COLUMNS = ('PID', 'Name', 'CPU %', 'Power (W)', 'Energy (J)', 'GPU SM %', 'GPU Mem (MiB)')
+
+    def __init__(self, package_watts):
+        super().__init__()
+        self.package_watts = package_watts
+        self.tracker = ProcessTracker()
+        self.initUI()
+
+    def initUI(self):
+        self.setWindowTitle('Processes')
+        self.setGeometry(150, 150, 800, 600)
+
+        layout = QVBoxLayout()
+
+        self.process_table = QTableWidget(0, len(self.COLUMNS), self)
+        self.process_table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.process_table.verticalHeader().setVisible(False)
+        self.process_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.process_table)
+
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh_processes)
+
+    def refresh_processes(self):
+        try:
+            self.tracker.update(self.package_watts())
+        except Exception as e:
+            print(f"Error updating processes: {str(e)}")
+            return
+
+        rows = self.tracker.top()
+        self.process_table.setRowCount(len(rows))
+        for row, (pid, state) in enumerate(rows):
+            gpu = state.get('gpu')
+            values = (
+                str(pid),
+                state['name'],
+                f"{state['cpu_percent']:.1f}",
+                f"{state['watts']:.2f}",
+                f"{state['energy_j']:.1f}",
+                f"{gpu['sm_util']:.0f}" if gpu else "",
+                f"{gpu['memory_mib']:.0f}" if gpu else "",
+            )
+            for column, value in enumerate(values):
+                self.process_table.setItem(row, column, QTableWidgetItem(value))
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh_processes()
+        self.timer.start(1000)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.timer.stop()
+
+    def closeEvent(self, event):
+        self.tracker.close()
+        super().closeEvent(event)
+
 class OverclockApp(QWidget):
     def __init__(self):
         super().__init__()
@@ -154,24 +1193,7 @@ class OverclockApp(QWidget):
                     fan_speed = int(fan_speed_text.replace('%', ''))
                     fan_speed_script = f"nvmlDeviceSetGpuFanSpeed(myGPU, {fan_speed})\n"
 
-            script_content = f"""
-from pynvml import *
-nvmlInit()
-myGPU = nvmlDeviceGetHandleByIndex({gpu_index})
-nvmlDeviceSetGpcClkVfOffset(myGPU, {gpu_offset})
-nvmlDeviceSetMemClkVfOffset(myGPU, {mem_offset})
-nvmlDeviceSetPowerManagementLimit(myGPU, {power_limit})
-{fan_speed_script}
-nvmlShutdown()
-"""
-            temp_script_path = "/tmp/temp_overclock.py"
-            with open(temp_script_path, "w") as f:
-                f.write(script_content)
-
-            os.chmod(temp_script_path, 0o755)
-
-            # Run the script using pkexec for root privileges
-            result = subprocess.run(["pkexec", "python3", temp_script_path], capture_output=True, text=True)
+            result = run_overclock_script(gpu_index, gpu_offset, mem_offset, power_limit, fan_speed_script)
             if result.returncode == 0:
                 QMessageBox.information(self, "Success", "Overclock settings applied successfully")
             else:
@@ -182,9 +1204,23 @@ nvmlShutdown()
 class WattageMonitor(QMainWindow):
     def __init__(self):
         super().__init__()
+        self.instrumentation = Instrumentation()
         self.cpu_name, self.cpu_codename = self.get_cpu_info()
         self.gpu_info = self.get_gpu_info()
         self.ram_info = self.get_ram_info()
+        self.power_limits = self.get_power_limits()
+        self.gpu_index = 0
+        self.gpu_handle = self.get_gpu_handle()
+        self.alert_engine = AlertEngine(gpu_index=self.gpu_index)
+        self.history_recorder = HistoryRecorder()
+        self.snapshot = {}
+        self.sampling_policy = 'full'
+        # Stays on the full rate until the window has been shown once
+        self.sampling_policy_ready = False
+        self.expose_filter_installed = False
+        # Updated from Expose events, a freshly shown window counts as exposed
+        self.window_exposed = True
+        self.mains_online_files = self.get_mains_online_files()
         self.initUI()
         self.setWindowTitle("CPU and GPU Monitor")
         self.setGeometry(100, 100, 800, 1000)
@@ -218,8 +1254,9 @@ class WattageMonitor(QMainWindow):
 
         if self.sudo_password:
             self.timer = QTimer(self)
-            self.timer.timeout.connect(self.update_metrics)
-            self.timer.start(1000)  # Update every second
+            self.timer.timeout.connect(self.update_metrics_timed)
+            self.timer.start(SAMPLING_POLICIES['full'])  # Update every second
+            self.instrumentation.set_tick_interval(self.timer.interval() / 1000)
             self.update_metrics()
 
     def initUI(self):
@@ -383,6 +1420,26 @@ class WattageMonitor(QMainWindow):
         gpu_info_with_oc_layout.addWidget(self.oc_button)
         main_layout.addLayout(gpu_info_with_oc_layout)
 
+        self.alerts_button = QPushButton("Alert Rules")
+        self.alerts_button.clicked.connect(self.open_alerts_window)
+        main_layout.addWidget(self.alerts_button)
+
+        self.debug_button = QPushButton("Debug")
+        self.debug_button.clicked.connect(self.open_debug_window)
+        main_layout.addWidget(self.debug_button)
+
+        self.record_history_checkbox = QCheckBox("Record history")
+        self.record_history_checkbox.setChecked(True)
+        main_layout.addWidget(self.record_history_checkbox)
+
+        self.report_button = QPushButton("History Report")
+        self.report_button.clicked.connect(self.open_report_window)
+        main_layout.addWidget(self.report_button)
+
+        self.processes_button = QPushButton("Processes")
+        self.processes_button.clicked.connect(self.open_process_window)
+        main_layout.addWidget(self.processes_button)
+
         # RAM Information
         ram_info_group = QGroupBox("RAM Information")
         ram_layout = QVBoxLayout()
@@ -400,7 +1457,7 @@ class WattageMonitor(QMainWindow):
         main_layout.addWidget(ram_info_group)
 
         refresh_button = QPushButton("Refresh", self)
-        refresh_button.clicked.connect(self.update_metrics)
+        refresh_button.clicked.connect(lambda: self.update_metrics())
         main_layout.addWidget(refresh_button)
 
         container = QWidget()
@@ -411,6 +1468,23 @@ class WattageMonitor(QMainWindow):
         self.oc_window = OverclockApp()
         self.oc_window.show()
 
+    def open_alerts_window(self):
+        self.alerts_window = AlertsWindow(self.alert_engine)
+        self.alerts_window.show()
+
+    def open_debug_window(self):
+        self.debug_window = DebugWindow(self.instrumentation)
+        self.debug_window.show()
+
+    def open_report_window(self):
+        self.history_recorder.flush()
+        self.report_window = ReportWindow()
+        self.report_window.show()
+
+    def open_process_window(self):
+        self.process_window = ProcessWindow(lambda: self.snapshot.get('cpu_wattage'))
+        self.process_window.show()
+
     def create_label(self, text, attribute=None):
         label = QLabel(text, self)
         label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -444,7 +1518,7 @@ class WattageMonitor(QMainWindow):
 
     def get_cpu_info(self):
         try:
-            result = subprocess.run(['lscpu'], capture_output=True, text=True)
+            result = self.instrumentation.run(['lscpu'], capture_output=True, text=True)
             output = result.stdout
             cpu_name = ""
             cpu_codename = ""
@@ -459,7 +1533,7 @@ class WattageMonitor(QMainWindow):
 
     def get_gpu_info(self):
         try:
-            result = subprocess.run(['nvidia-smi', '--query-gpu=name,gpu_bus_id', '--format=csv,noheader'], capture_output=True, text=True)
+            result = self.instrumentation.run(['nvidia-smi', '--query-gpu=name,gpu_bus_id', '--format=csv,noheader'], capture_output=True, text=True)
             output = result.stdout.strip()
             if output:
                 name, gpu_type = output.split(',')
@@ -470,7 +1544,7 @@ class WattageMonitor(QMainWindow):
 
     def get_ram_info(self):
         try:
-            result = subprocess.run(['sudo', 'dmidecode', '--type', 'memory'], capture_output=True, text=True)
+            result = self.instrumentation.run(['sudo', 'dmidecode', '--type', 'memory'], capture_output=True, text=True)
             output = result.stdout
             ram_info = []
             current_info = {}
@@ -508,10 +1582,139 @@ class WattageMonitor(QMainWindow):
         except Exception as e:
             return [f"Error: {str(e)}"]
 
+    def get_mains_online_files(self):
+        online_files = []
+        for supply in glob.glob('/sys/class/power_supply/*'):
+            try:
+                with open(os.path.join(supply, 'type'), 'r') as f:
+                    if f.read().strip() == 'Mains':
+                        online_files.append(os.path.join(supply, 'online'))
+            except Exception as e:
+                continue
+        return online_files
+
+    def on_ac_power(self):
+        # Desktops without a Mains supply entry are treated as plugged in
+        if not self.mains_online_files:
+            return True
+        for online_file in self.mains_online_files:
+            try:
+                with open(online_file, 'r') as f:
+                    if f.read().strip() == '1':
+                        return True
+            except Exception as e:
+                continue
+        return False
+
+    def is_window_shown(self):
+        return self.isVisible() and not self.isMinimized() and self.window_exposed
+
+    def select_sampling_policy(self):
+        # Armed or active alert rules need full resolution to time their duration
+        if self.alert_engine.armed:
+            return 'full'
+        on_battery = not self.on_ac_power()
+        if self.is_window_shown():
+            return 'battery' if on_battery else 'full'
+        return 'background_battery' if on_battery else 'background'
+
+    def apply_sampling_policy(self):
+        timer = getattr(self, 'timer', None)
+        if timer is None or not self.sampling_policy_ready:
+            return False
+        policy = self.select_sampling_policy()
+        if policy == self.sampling_policy:
+            return False
+
+        was_background = self.sampling_policy.startswith('background')
+        background = policy.startswith('background')
+        self.sampling_policy = policy
+        interval = SAMPLING_POLICIES[policy]
+        # Coarse timers let the kernel batch our wakeups with others
+        timer.setTimerType(Qt.TimerType.VeryCoarseTimer if background else Qt.TimerType.CoarseTimer)
+        timer.start(interval)
+        self.instrumentation.sampling_policy = policy
+        self.instrumentation.set_tick_interval(interval / 1000)
+        return was_background and not background
+
+    def closeEvent(self, event):
+        # Stop sampling first, otherwise the next tick would start a new history session
+        self.sampling_policy_ready = False
+        timer = getattr(self, 'timer', None)
+        if timer is not None:
+            timer.stop()
+        self.history_recorder.close()
+        if self.gpu_handle is not None:
+            self.gpu_handle = None
+            nvmlShutdown()
+        super().closeEvent(event)
+
+    def refresh_sampling_policy(self):
+        if self.apply_sampling_policy():
+            self.update_metrics()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.sampling_policy_ready = True
+        # Moving to or from another workspace only shows up as an Expose event on the native window
+        if not self.expose_filter_installed and self.windowHandle() is not None:
+            self.windowHandle().installEventFilter(self)
+            self.expose_filter_installed = True
+        self.window_exposed = True
+        QTimer.singleShot(0, self.refresh_sampling_policy)
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.apply_sampling_policy()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.Type.WindowStateChange:
+            self.refresh_sampling_policy()
+
+    def eventFilter(self, obj, event):
+        if obj is self.windowHandle() and event.type() == QEvent.Type.Expose:
+            self.window_exposed = obj.isExposed()
+            QTimer.singleShot(0, self.refresh_sampling_policy)
+        return super().eventFilter(obj, event)
+
+    def get_power_limits(self):
+        power_limits = {}
+        for name, constraint in (('pl1', 0), ('pl2', 1)):
+            try:
+                with open(f"/sys/class/powercap/intel-rapl:0/constraint_{constraint}_power_limit_uw", "r") as f:
+                    power_limits[name] = int(f.read().strip()) / 1e6  # Convert from uW to W
+            except Exception as e:
+                continue
+        return power_limits
+
+    def get_gpu_handle(self):
+        # Cached so each tick is a few NVML calls instead of an nvidia-smi fork
+        try:
+            nvmlInit()
+        except Exception as e:
+            return None
+        try:
+            return nvmlDeviceGetHandleByIndex(self.gpu_index)
+        except Exception as e:
+            nvmlShutdown()
+            return None
+
+    def get_gpu_metrics(self):
+        if self.gpu_handle is None:
+            return None
+        try:
+            core_clock = float(nvmlDeviceGetClockInfo(self.gpu_handle, NVML_CLOCK_GRAPHICS))
+            memory_clock = float(nvmlDeviceGetClockInfo(self.gpu_handle, NVML_CLOCK_MEM))
+            gpu_temp = float(nvmlDeviceGetTemperature(self.gpu_handle, NVML_TEMPERATURE_GPU))
+            return core_clock, memory_clock, gpu_temp
+        except Exception as e:
+            return None
+
     def get_vcore(self):
         try:
             command = f"echo {self.sudo_password} | sudo -S rdmsr 0x198 -u --bitfield 47:32"
-            result = subprocess.run(command, shell=True, capture_output=True, text=True)
+            result = self.instrumentation.run(command, name='rdmsr', shell=True, capture_output=True, text=True)
             voltage_raw = int(result.stdout.strip())
             voltage = voltage_raw / 8192  # Convert to volts
             return voltage
@@ -530,22 +1733,32 @@ class WattageMonitor(QMainWindow):
         except Exception as e:
             return None
 
-    def update_metrics(self):
+    def update_metrics_timed(self):
+        self.update_metrics(timed=True)
+
+    def update_metrics(self, timed=False):
         if not self.sudo_password:
             return
 
+        self.snapshot = dict(self.power_limits)
+        self.instrumentation.begin_tick(timed)
+
         try:
             # Update the real-time clock
             current_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
             self.clock_label.setText(current_time)
 
             # Change the file permission using sudo
-            command = f"echo {self.sudo_password} | sudo -S chmod o+r /sys/class/powercap/intel-rapl:0/energy_uj"
-            subprocess.run(command, shell=True, check=True, stderr=subprocess.PIPE)
+            # Only needed once per boot, so skip the sudo fork when already readable
+            if not os.access(RAPL_ENERGY_PATH, os.R_OK):
+                command = f"echo {self.sudo_password} | sudo -S chmod o+r {RAPL_ENERGY_PATH}"
+                with self.instrumentation.measure('chmod'):
+                    self.instrumentation.run(command, name='chmod', shell=True, check=True, stderr=subprocess.PIPE)
 
             # Read the energy value
-            with open("/sys/class/powercap/intel-rapl:0/energy_uj", "r") as f:
-                energy_uj = int(f.read().strip())
+            with self.instrumentation.measure('rapl'):
+                with open(RAPL_ENERGY_PATH, "r") as f:
+                    energy_uj = int(f.read().strip())
 
             current_time = time.time()
 
@@ -557,6 +1770,7 @@ class WattageMonitor(QMainWindow):
                 # Calculate the power in watts
                 wattage = energy_diff_j / time_interval
                 self.wattage_values.append(wattage)
+                self.snapshot['cpu_wattage'] = wattage
 
                 self.realtime_wattage_label.setText(f"{wattage:.2f} W")
                 self.min_wattage_label.setText(f"{min(self.wattage_values):.2f} W")
@@ -577,17 +1791,19 @@ class WattageMonitor(QMainWindow):
             self.last_time = current_time
 
             # Read CPU frequencies
-            freq_files = glob.glob('/sys/devices/system/cpu/cpu*/cpufreq/scaling_cur_freq')
-            frequencies = []
-            for freq_file in freq_files:
-                with open(freq_file, 'r') as f:
-                    freq = int(f.read().strip()) / 1000  # Convert from kHz to MHz
-                    frequencies.append(freq)
+            with self.instrumentation.measure('cpufreq'):
+                freq_files = glob.glob('/sys/devices/system/cpu/cpu*/cpufreq/scaling_cur_freq')
+                frequencies = []
+                for freq_file in freq_files:
+                    with open(freq_file, 'r') as f:
+                        freq = int(f.read().strip()) / 1000  # Convert from kHz to MHz
+                        frequencies.append(freq)
 
             if frequencies:
                 min_freq = min(frequencies)
                 max_freq = max(frequencies)
                 avg_freq = sum(frequencies) / len(frequencies)
+                self.snapshot['cpu_freq'] = avg_freq
 
                 self.min_freq_label.setText(f"{min_freq:.2f} MHz")
                 self.max_freq_label.setText(f"{max_freq:.2f} MHz")
@@ -611,9 +1827,11 @@ class WattageMonitor(QMainWindow):
                 self.cpu_freq_label.setText("Calculating...")
 
             # Get Vcore value
-            vcore = self.get_vcore()
+            with self.instrumentation.measure('rdmsr'):
+                vcore = self.get_vcore()
             if vcore is not None:
                 self.vcore_values.append(vcore)
+                self.snapshot['vcore'] = vcore
 
                 self.realtime_voltage_label.setText(f"{vcore:.3f} V")
                 self.min_voltage_label.setText(f"{min(self.vcore_values):.3f} V")
@@ -630,11 +1848,14 @@ class WattageMonitor(QMainWindow):
                 self.realtime_voltage_label.setText("Unknown")
 
             # Get core temperatures
-            temperatures = self.get_core_temperatures()
+            with self.instrumentation.measure('hwmon'):
+                temperatures = self.get_core_temperatures()
             if temperatures:
                 min_temp = min(temperatures)
                 max_temp = max(temperatures)
                 avg_temp = sum(temperatures) / len(temperatures)
+                self.snapshot['cpu_temp'] = avg_temp
+                self.snapshot['cpu_temp_max'] = max_temp
 
                 self.realtime_temperature_label.setText(f"{avg_temp:.2f} °C")
                 self.min_temperature_label.setText(f"{min_temp:.2f} °C")
@@ -660,13 +1881,16 @@ class WattageMonitor(QMainWindow):
                 self.avg_temperature_label.setText("Calculating...")
 
             # Update GPU information
-            gpu_result = subprocess.run(['nvidia-smi', '--query-gpu=clocks.current.graphics,clocks.current.memory,temperature.gpu', '--format=csv,noheader,nounits'], capture_output=True, text=True)
-            gpu_output = gpu_result.stdout.strip()
-            if gpu_output:
-                core_clock, memory_clock, gpu_temp = map(float, gpu_output.split(', '))
+            with self.instrumentation.measure('nvml'):
+                gpu_metrics = self.get_gpu_metrics()
+            if gpu_metrics is not None:
+                core_clock, memory_clock, gpu_temp = gpu_metrics
                 self.gpu_core_clock_values.append(core_clock)
                 self.gpu_memory_clock_values.append(memory_clock)
                 self.gpu_temp_values.append(gpu_temp)
+                self.snapshot['gpu_core_clock'] = core_clock
+                self.snapshot['gpu_memory_clock'] = memory_clock
+                self.snapshot['gpu_temp'] = gpu_temp
 
                 self.gpu_core_clock_label.setText(f"{core_clock} MHz")
                 self.gpu_memory_clock_label.setText(f"{memory_clock} MHz")
@@ -722,6 +1946,17 @@ class WattageMonitor(QMainWindow):
             self.gpu_min_temp_label.setText(f"Error: {str(e)}")
             self.gpu_max_temp_label.setText(f"Error: {str(e)}")
 
+        with self.instrumentation.measure('alerts'):
+            self.alert_engine.evaluate(self.snapshot)
+        if self.record_history_checkbox.isChecked():
+            with self.instrumentation.measure('history'):
+                try:
+                    self.history_recorder.record(self.snapshot)
+                except Exception as e:
+                    print(f"Error recording history: {str(e)}")
+        self.instrumentation.end_tick(self.snapshot.get('cpu_wattage'))
+        self.apply_sampling_policy()
+
     def update_core_freq(self):
         core_index = self.core_freq_dropdown.currentIndex()
         if core_index < len(self.freq_values):
@@ -749,7 +1984,45 @@ class WattageMonitor(QMainWindow):
             self.ram_info_group.show()
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="HWMi hardware monitor")
+    parser.add_argument('--report', nargs='?', const='latest', metavar='SESSION',
+                        help="print an analytics report for a recorded session (default: latest) and exit")
+    parser.add_argument('--window', type=float, default=60, help="window in seconds for windowed percentiles")
+    parser.add_argument('--resample', type=float, metavar='SECONDS',
+                        help="print the latest (or --report) session resampled to SECONDS as CSV and exit")
+    args, qt_args = parser.parse_known_args()
+    if args.window <= 0:
+        parser.error("--window must be greater than 0")
+    if args.resample is not None and args.resample <= 0:
+        parser.error("--resample must be greater than 0")
+
+    if args.report or args.resample is not None:
+        path = args.report if args.report and args.report != 'latest' else None
+        if path is None:
+            sessions = list_history_sessions()
+            if not sessions:
+                sys.exit("No recorded sessions")
+            path = sessions[-1]
+        try:
+            if args.resample is not None:
+                columns, data = load_history(path)
+                if not len(data):
+                    sys.exit("No samples")
+                metrics = [column for column in columns if column not in HISTORY_TIME_COLUMNS]
+                times, means = resample_history(history_times(columns, data),
+                                                np.asarray(data[:, [columns.index(metric) for metric in metrics]]),
+                                                args.resample)
+                session_start = data[0, columns.index('timestamp')]
+                print(",".join(['timestamp'] + metrics))
+                for elapsed, row in zip(times, means):
+                    print(f"{session_start + elapsed:.3f}," + ",".join(f"{value:.4f}" for value in row))
+            else:
+                print(format_history_report(path, args.window))
+        except Exception as e:
+            sys.exit(f"Error: {str(e)}")
+        sys.exit(0)
+
+    app = QApplication(sys.argv[:1] + qt_args)
     monitor = WattageMonitor()
     monitor.show()
     sys.exit(app.exec())